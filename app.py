@@ -1,6 +1,5 @@
 import streamlit as st
 import pandas as pd
-import time
 from io import BytesIO
 from utils import (
     preprocess_data, 
@@ -185,7 +184,7 @@ if uploaded_file is not None:
 
             # 預先計算潛在調貨量
             with st.spinner("正在預先計算潛在調貨量..."):
-                potential = estimate_transfer_potential(st.session_state.cleaned_df.copy())
+                potential = estimate_transfer_potential(st.session_state.cleaned_df)
             
             st.subheader("潛在調貨量預估")
             col1, col2, col3, col4 = st.columns(4)
@@ -214,7 +213,6 @@ if uploaded_file is not None:
                         transfer_type_dist, 
                         receive_type_dist
                     ) = generate_recommendations(st.session_state.cleaned_df.copy(), transfer_mode)
-                    time.sleep(1) # 模擬耗時操作
                 progress_bar.progress(90, text="分析完成！正在準備結果展示...")
 
                 if not recommendations_df.empty:
@@ -264,6 +262,9 @@ if uploaded_file is not None:
                     st.subheader("OM 調貨分析圖表 (OM Transfer vs Receive Analysis Chart)")
                     om_chart_fig = create_om_transfer_chart(recommendations_df, transfer_mode)
                     st.pyplot(om_chart_fig)
+                    # 圖表已輸出，關閉 Figure 以免 pyplot 在伺服器行程中持續累積
+                    import matplotlib.pyplot as plt
+                    plt.close(om_chart_fig)
 
                     with st.expander("資料檢核：ND接收剔除"):
                         removed = st.session_state.get('diag_removed_nd')
@@ -14,7 +14,7 @@ def main():
     senders, receivers = _calculate_candidates(df, mode)
     print('Receivers:')
     for r in receivers:
-        d = r['data']
+        d = df.iloc[r['pos']]
         print(d['Site'], d['OM'], d['RP Type'], r['needed_qty'], r['type'], r['effective_sales'])
 
 
@@ -0,0 +1,112 @@
+"""
+Regression check for generate_recommendations.
+
+Runs all three transfer modes over fixed inputs and compares the recommendation
+tables with the expected output stored in regression_expected.csv.
+
+    python regression_check.py          # compare, exit code 1 on any difference
+    python regression_check.py save     # re-record the expected output
+
+Run it after any change to the matching code (_match_kernel and friends).
+Setting NUMBA_DISABLE_JIT=1 checks the pure-Python path of the kernel as well.
+"""
+import io
+import sys
+
+import numpy as np
+import pandas as pd
+
+import utils
+from dev_test import make_df
+from utils import preprocess_data, generate_recommendations
+
+MODES = ['A: 保守轉貨', 'B: 加強轉貨', 'C: 重點補0']
+WORKBOOKS = ['test_data_20250917_222853.xlsx', 'MAY_12Nov2025.XLSX']
+EXPECTED_PATH = 'regression_expected.csv'
+
+
+def make_synthetic_df(seed=2025, n_articles=30, n_sites=12, n_oms=3):
+    """Deterministic mixed ND/RF inventory with several OMs per article"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for a in range(n_articles):
+        for s in range(n_sites):
+            if rng.random() < 0.25:
+                continue
+            rows.append({
+                'Article': f'{100000000000 + a * 7919}', 'Article Description': f'Item {a}',
+                'RP Type': 'ND' if rng.random() < 0.25 else 'RF', 'Site': f'S{s:03d}', 'OM': f'OM{s % n_oms}',
+                'MOQ': int(rng.choice([1, 2, 3, 6])),
+                'SaSa Net Stock': int(rng.choice([0, 0, 1, 2, 3, 5, 8, 12, 20, 40])),
+                'Pending Received': int(rng.choice([0, 0, 0, 1, 2, 5])),
+                'Safety Stock': int(rng.choice([0, 0, 2, 4, 6, 10, 15])),
+                'Last Month Sold Qty': int(rng.choice([0, 0, 1, 2, 5, 9, 14])),
+                'MTD Sold Qty': int(rng.choice([0, 0, 1, 3, 7])),
+            })
+    return pd.DataFrame(rows)
+
+
+def datasets():
+    """(name, DataFrame) pairs; workbooks and synthetic data go through preprocess_data like the app"""
+    yield 'dev_test', make_df()
+    for path in WORKBOOKS:
+        processed_df, _ = preprocess_data(pd.read_excel(path))
+        yield path, processed_df
+    processed_df, _ = preprocess_data(make_synthetic_df())
+    yield 'synthetic', processed_df
+
+
+def run_all():
+    frames = []
+    for name, df in datasets():
+        for mode in MODES:
+            rec_df, *_ = generate_recommendations(df.copy(), mode)
+            if not rec_df.empty:
+                frames.append(rec_df.assign(Dataset=name, Mode=mode))
+    result = pd.concat(frames, ignore_index=True)
+    result = result[['Dataset', 'Mode'] + [c for c in result.columns if c not in ('Dataset', 'Mode')]]
+    # Compare through the CSV text form so dtype differences do not count as changes
+    # (a whole-number float such as 5.0 is written as 5)
+    text = pd.read_csv(io.StringIO(result.to_csv(index=False)), dtype=str, keep_default_na=False)
+    return text.replace(r'^(-?\d+)\.0$', r'\1', regex=True)
+
+
+def compare(expected, actual):
+    if list(expected.columns) != list(actual.columns):
+        print(f'Column mismatch:\n  expected {list(expected.columns)}\n  actual   {list(actual.columns)}')
+        return False
+    ok = True
+    keys = ['Dataset', 'Mode']
+    exp_groups = dict(tuple(expected.groupby(keys, sort=False)))
+    act_groups = dict(tuple(actual.groupby(keys, sort=False)))
+    for key in sorted(set(exp_groups) | set(act_groups)):
+        exp = exp_groups.get(key, expected.iloc[0:0]).reset_index(drop=True)
+        act = act_groups.get(key, actual.iloc[0:0]).reset_index(drop=True)
+        if len(exp) != len(act):
+            print(f'{key}: {len(act)} rows, expected {len(exp)}')
+            ok = False
+            continue
+        diff = (exp != act).any(axis=1)
+        if diff.any():
+            row = int(np.flatnonzero(diff.to_numpy())[0])
+            cols = [c for c in exp.columns if exp.at[row, c] != act.at[row, c]]
+            print(f'{key}: {int(diff.sum())} rows differ; first at row {row}, columns {cols}')
+            ok = False
+    return ok
+
+
+if __name__ == '__main__':
+    actual = run_all()
+    if len(sys.argv) > 1 and sys.argv[1] == 'save':
+        actual.to_csv(EXPECTED_PATH, index=False)
+        print(f'Saved {len(actual)} rows to {EXPECTED_PATH}')
+        sys.exit(0)
+
+    expected = pd.read_csv(EXPECTED_PATH, dtype=str, keep_default_na=False)
+    ok = compare(expected, actual)
+    # Run again with a tiny lock bitmap so the article-chunked matching path is exercised too
+    utils.MATCH_LOCK_CELLS = 25
+    generate_recommendations.clear()
+    ok = compare(expected, run_all()) and ok
+    print('OK' if ok else 'FAILED')
+    sys.exit(0 if ok else 1)
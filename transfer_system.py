@@ -1,22 +1,71 @@
 import pandas as pd
 import numpy as np
+from dataclasses import dataclass
 from datetime import datetime
+import hashlib
 import logging
+import os
+import tempfile
 from typing import List, Dict, Tuple, Optional, Any, Union
-import re
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Arrow-backed string dtype for key columns: contiguous UTF-8 buffers instead of one PyObject per cell
+# (same dtype as utils.ARROW_STRING)
+ARROW_STRING = pd.StringDtype('pyarrow')
+
+@dataclass
+class Candidates:
+    """Transfer candidates as parallel arrays (struct-of-arrays), one element per candidate"""
+    article_code: np.ndarray
+    om_code: np.ndarray
+    site_code: np.ndarray
+    rp_type_code: np.ndarray
+    qty: np.ndarray  # Transferable qty for suppliers, needed qty for receivers
+    priority: np.ndarray
+    stock: np.ndarray  # Original stock for suppliers, current stock for receivers
+    labels: Dict[str, Any]  # Code -> value lookup for 'article', 'om', 'site' and 'rp_type'
+    
+    def __len__(self) -> int:
+        return len(self.qty)
+
+# Bump when _preprocess_data changes so stale Parquet caches are not reused
+PREPROCESS_CACHE_VERSION = 1
+
 class TransferOptimizer:
-    def __init__(self):
+    def __init__(self, cache_dir: Optional[str] = None):
         self.transfer_recommendations = []
         self.quality_checks = []
+        # Directory for preprocessed Parquet snapshots of input files (disabled when None)
+        self.cache_dir = cache_dir
+    
+    def _cache_path(self, file_path: str) -> str:
+        """Cache file for the preprocessed data, keyed on the input path, size and mtime"""
+        stat = os.stat(file_path)
+        key = f"{PREPROCESS_CACHE_VERSION}:{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        return os.path.join(self.cache_dir, hashlib.blake2b(key.encode()).hexdigest()[:16] + '.parquet')
     
     def read_and_validate_data(self, file_path: str) -> pd.DataFrame:
         """Read Excel file and perform data validation and transformation"""
         try:
+            cache_path = self._cache_path(file_path) if self.cache_dir else None
+            if cache_path and os.path.exists(cache_path):
+                try:
+                    df = pd.read_parquet(cache_path, engine='pyarrow')
+                    # Make sure the key columns come back with the Arrow string storage
+                    df = df.astype({col: ARROW_STRING for col in ('Article', 'OM', 'RP Type', 'Site') if col in df.columns})
+                    logger.info(f"Loaded preprocessed data from cache: {cache_path}, shape: {df.shape}")
+                    return df
+                except Exception as e:
+                    # Unreadable cache (e.g. left by an interrupted write): drop it and rebuild from Excel
+                    logger.warning(f"Ignoring unreadable cache {cache_path}: {str(e)}")
+                    try:
+                        os.remove(cache_path)
+                    except OSError:
+                        pass
+            
             # Read Excel file
             df = pd.read_excel(file_path)
             logger.info(f"Successfully read file: {file_path}, shape: {df.shape}")
@@ -24,6 +73,20 @@ class TransferOptimizer:
             # Data preprocessing and validation
             df = self._preprocess_data(df)
             
+            if cache_path:
+                tmp_path = None
+                try:
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    # Write to a temp file and rename it into place so readers never see a partial file
+                    fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.parquet.tmp')
+                    os.close(fd)
+                    df.to_parquet(tmp_path, engine='pyarrow', compression='snappy', index=False)
+                    os.replace(tmp_path, cache_path)
+                except Exception as e:
+                    logger.warning(f"Could not cache preprocessed data: {str(e)}")
+                    if tmp_path and os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+            
             return df
             
         except Exception as e:
@@ -34,9 +97,9 @@ class TransferOptimizer:
         """Data preprocessing and validation"""
         # Article field forced to 12-digit text format
         if 'Article' in df.columns:
-            df['Article'] = df['Article'].astype(str).str.strip()
-            # Remove non-digit characters, then pad to 12 digits
-            df['Article'] = df['Article'].apply(lambda x: re.sub(r'\D', '', x).zfill(12))
+            df['Article'] = df['Article'].astype(str).astype(ARROW_STRING).str.strip()
+            # Remove non-digit characters, then pad to 12 digits (runs as Arrow compute kernels)
+            df['Article'] = df['Article'].str.replace(r'\D', '', regex=True).str.pad(12, side='left', fillchar='0')
         
         # Numeric field processing
         numeric_columns = ['SaSa Net Stock', 'Pending Received', 'Safety Stock', 
@@ -54,152 +117,146 @@ class TransferOptimizer:
                 # Special handling for sales fields
                 if col in ['Last Month Sold Qty', 'MTD Sold Qty']:
                     df[col] = df[col].clip(upper=100000)
+                else:
+                    # Cap at the int32 maximum so the narrowing below cannot wrap to negative
+                    df[col] = df[col].clip(upper=np.iinfo(np.int32).max)
+                
+                # Quantities are whole units well below 2**31: keep them as int32
+                df[col] = df[col].astype('int32')
         
         # Text field processing
         text_columns = ['OM', 'RP Type', 'Site']
         for col in text_columns:
             if col in df.columns:
-                df[col] = df[col].astype(str).fillna("").str.strip()
+                df[col] = df[col].astype(str).fillna("").astype(ARROW_STRING).str.strip()
         
         # Add effective sales quantity field
-        df['Effective Sold Qty'] = df.apply(
-            lambda row: row['Last Month Sold Qty'] if row['Last Month Sold Qty'] > 0 
-            else row['MTD Sold Qty'], axis=1
-        )
+        last_month = df['Last Month Sold Qty'].to_numpy()
+        df['Effective Sold Qty'] = np.where(last_month > 0, last_month, df['MTD Sold Qty'].to_numpy())
         
         return df
     
-    def identify_transfer_candidates(self, df: pd.DataFrame) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    def identify_transfer_candidates(self, df: pd.DataFrame) -> Tuple[Candidates, Candidates]:
         """Identify transfer-out candidates and receive candidates"""
-        suppliers: List[Dict[str, Any]] = []  # Transfer-out candidates
-        receivers: List[Dict[str, Any]] = []  # Receive candidates
+        # Keep the Article+OM grouping order; rows stay in file order within each group
+        df = df.sort_values(['Article', 'OM'], kind='stable')
         
-        # Process by Article+OM grouping
-        grouped = df.groupby(['Article', 'OM'])
+        # Calculate maximum sales quantity within each Article+OM group
+        max_sold_qty = df.groupby(['Article', 'OM'])['Effective Sold Qty'].transform('max').to_numpy()
         
-        for (article, om), group in grouped:
-            # Calculate maximum sales quantity within group
-            max_sold_qty = group['Effective Sold Qty'].max()
-            
-            for _, row in group.iterrows():
-                site = row.get('Site', '')
-                rp_type = row.get('RP Type', '')
-                net_stock = row.get('SaSa Net Stock', 0)
-                pending_received = row.get('Pending Received', 0)
-                safety_stock = row.get('Safety Stock', 0)
-                sold_qty = row.get('Effective Sold Qty', 0)
-                
-                # Transfer-out rule - Priority 1: ND type transfer-out
-                if rp_type == 'ND':
-                    suppliers.append({
-                        'article': article,
-                        'om': om,
-                        'site': site,
-                        'rp_type': rp_type,
-                        'transferable_qty': net_stock,
-                        'priority': 1,
-                        'original_stock': net_stock
-                    })
-                
-                # Transfer-out rule - Priority 2: RF type surplus transfer-out
-                elif (rp_type == 'RF' and 
-                      (float(net_stock) + float(pending_received)) > float(safety_stock) and
-                      float(sold_qty) != float(max_sold_qty)):
-                    # Calculate base transferable quantity
-                    transferable = float(net_stock) + float(pending_received) - float(safety_stock)
-                    
-                    # Apply 20% upper limit: max 20% of (net_stock + pending_received)
-                    max_transferable = int((float(net_stock) + float(pending_received)) * 0.2)
-                    transferable = min(transferable, max_transferable)
-                    
-                    # Apply minimum 2 pieces requirement
-                    if transferable < 2:
-                        transferable = 0
-                    
-                    if transferable > 0:
-                        suppliers.append({
-                            'article': article,
-                            'om': om,
-                            'site': site,
-                            'rp_type': rp_type,
-                            'transferable_qty': int(transferable),
-                            'priority': 2,
-                            'original_stock': int(net_stock)
-                        })
-                
-                # Receive rule - Priority 1: Emergency shortage replenishment
-                if (rp_type == 'RF' and 
-                    net_stock == 0 and 
-                    sold_qty > 0):
-                    receivers.append({
-                        'article': article,
-                        'om': om,
-                        'site': site,
-                        'rp_type': rp_type,
-                        'needed_qty': safety_stock,
-                        'priority': 1,
-                        'current_stock': net_stock
-                    })
-                
-                # Receive rule - Priority 2: Potential shortage replenishment
-                elif (rp_type == 'RF' and 
-                      (net_stock + pending_received) < safety_stock and
-                      sold_qty == max_sold_qty):
-                    needed = safety_stock - (net_stock + pending_received)
-                    receivers.append({
-                        'article': article,
-                        'om': om,
-                        'site': site,
-                        'rp_type': rp_type,
-                        'needed_qty': needed,
-                        'priority': 2,
-                        'current_stock': net_stock
-                    })
+        # Factorize key columns once so candidates carry integer codes instead of strings
+        labels: Dict[str, Any] = {}
+        codes: Dict[str, np.ndarray] = {}
+        for key, col in (('article', 'Article'), ('om', 'OM'), ('site', 'Site'), ('rp_type', 'RP Type')):
+            codes[key], labels[key] = pd.factorize(df[col] if col in df.columns else pd.Series('', index=df.index))
+        
+        # Columns are stored as int32; widen to int64 so stock + pending cannot wrap around
+        net_stock = df.get('SaSa Net Stock', pd.Series(0, index=df.index)).to_numpy(dtype=np.int64)
+        pending_received = df.get('Pending Received', pd.Series(0, index=df.index)).to_numpy(dtype=np.int64)
+        safety_stock = df.get('Safety Stock', pd.Series(0, index=df.index)).to_numpy(dtype=np.int64)
+        sold_qty = df['Effective Sold Qty'].to_numpy()
+        total_stock = net_stock + pending_received
+        rp_type = labels['rp_type'][codes['rp_type']]
+        is_nd = np.asarray(rp_type == 'ND', dtype=bool)
+        is_rf = np.asarray(rp_type == 'RF', dtype=bool)
+        
+        # Transfer-out rule - Priority 2: RF type surplus transfer-out
+        # Base transferable quantity, capped at 20% of (net_stock + pending_received)
+        rf_transferable = np.minimum(total_stock - safety_stock, total_stock // 5)
+        # Apply minimum 2 pieces requirement
+        rf_transferable = np.where(rf_transferable >= 2, rf_transferable, 0)
+        rf_surplus = (is_rf & (total_stock > safety_stock) &
+                      (sold_qty != max_sold_qty) & (rf_transferable > 0))
+        
+        # Transfer-out rule - Priority 1: ND type transfer-out (takes precedence over RF surplus)
+        supply = is_nd | rf_surplus
+        suppliers = Candidates(
+            article_code=codes['article'][supply],
+            om_code=codes['om'][supply],
+            site_code=codes['site'][supply],
+            rp_type_code=codes['rp_type'][supply],
+            qty=np.where(is_nd, net_stock, rf_transferable)[supply],
+            priority=np.where(is_nd, 1, 2)[supply],
+            stock=net_stock[supply],
+            labels=labels
+        )
+        
+        # Receive rule - Priority 1: Emergency shortage replenishment
+        emergency = is_rf & (net_stock == 0) & (sold_qty > 0)
+        # Receive rule - Priority 2: Potential shortage replenishment
+        potential = ~emergency & is_rf & (total_stock < safety_stock) & (sold_qty == max_sold_qty)
+        receive = emergency | potential
+        receivers = Candidates(
+            article_code=codes['article'][receive],
+            om_code=codes['om'][receive],
+            site_code=codes['site'][receive],
+            rp_type_code=codes['rp_type'][receive],
+            qty=np.where(emergency, safety_stock, safety_stock - total_stock)[receive],
+            priority=np.where(emergency, 1, 2)[receive],
+            stock=net_stock[receive],
+            labels=labels
+        )
         
         return suppliers, receivers
     
-    def match_transfers(self, suppliers: List[Dict[str, Any]], receivers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def match_transfers(self, suppliers: Candidates, receivers: Candidates) -> List[Dict[str, Any]]:
         """Match suppliers and receivers"""
-        transfer_suggestions: List[Dict[str, Any]] = []
+        sup_idx: List[int] = []
+        rcv_idx: List[int] = []
+        amounts: List[int] = []
+        
+        # Receivers are served in priority order (stable, so equal priorities keep candidate order)
+        receivers_sorted = np.argsort(receivers.priority, kind='stable')
         
-        # Sort by priority
-        suppliers_sorted = sorted(suppliers, key=lambda x: x['priority'])
-        receivers_sorted = sorted(receivers, key=lambda x: x['priority'])
+        # Suppliers are sorted once by Article+OM group, then priority; each receiver only
+        # scans the contiguous window of suppliers sharing its group
+        card = len(suppliers.labels['om'])
+        sup_keys = suppliers.article_code.astype(np.int64) * card + suppliers.om_code
+        suppliers_sorted = np.lexsort((suppliers.priority, sup_keys))
+        sup_keys = sup_keys[suppliers_sorted]
+        rcv_keys = receivers.article_code.astype(np.int64) * card + receivers.om_code
+        window_lo = np.searchsorted(sup_keys, rcv_keys, side='left')
+        window_hi = np.searchsorted(sup_keys, rcv_keys, side='right')
         
         # Matching logic
-        for receiver in receivers_sorted:
-            remaining_need = receiver['needed_qty']
+        for r in receivers_sorted:
+            remaining_need = receivers.qty[r]
+            if remaining_need <= 0:
+                continue
             
-            for supplier in suppliers_sorted:
-                if (supplier['article'] == receiver['article'] and 
-                    supplier['om'] == receiver['om'] and
-                    supplier['site'] != receiver['site'] and
-                    supplier['transferable_qty'] > 0 and
-                    remaining_need > 0):
-                    
-                    transfer_amount = min(supplier['transferable_qty'], remaining_need)
-                    
-                    # Create transfer suggestion
-                    suggestion = {
-                        'Article': supplier['article'],
-                        'OM': supplier['om'],
-                        'Transfer Site': supplier['site'],
-                        'Receive Site': receiver['site'],
-                        'Transfer Qty': transfer_amount,
-                        'Transfer Type': 'ND' if supplier['priority'] == 1 else 'RF',
-                        'Receive Priority': 'Emergency' if receiver['priority'] == 1 else 'Potential',
-                        'Original Stock': supplier['original_stock'],
-                        'Current Need': receiver['needed_qty']
-                    }
-                    
-                    transfer_suggestions.append(suggestion)
-                    
-                    # Update remaining quantity
-                    supplier['transferable_qty'] -= transfer_amount
-                    remaining_need -= transfer_amount
-                    
-                    if remaining_need <= 0:
-                        break
+            receive_site = receivers.site_code[r]
+            for s in suppliers_sorted[window_lo[r]:window_hi[r]]:
+                if suppliers.site_code[s] == receive_site or suppliers.qty[s] <= 0:
+                    continue
+                
+                transfer_amount = min(suppliers.qty[s], remaining_need)
+                sup_idx.append(s)
+                rcv_idx.append(r)
+                amounts.append(transfer_amount)
+                
+                # Update remaining quantity
+                suppliers.qty[s] -= transfer_amount
+                remaining_need -= transfer_amount
+                
+                if remaining_need <= 0:
+                    break
+        
+        # Create transfer suggestions in one pass
+        sup_idx_arr = np.asarray(sup_idx, dtype=np.intp)
+        rcv_idx_arr = np.asarray(rcv_idx, dtype=np.intp)
+        labels = suppliers.labels
+        suggestions_df = pd.DataFrame({
+            'Article': labels['article'][suppliers.article_code[sup_idx_arr]],
+            'OM': labels['om'][suppliers.om_code[sup_idx_arr]],
+            'Transfer Site': labels['site'][suppliers.site_code[sup_idx_arr]],
+            'Receive Site': labels['site'][receivers.site_code[rcv_idx_arr]],
+            'Transfer Qty': np.asarray(amounts, dtype=np.int64),
+            'Transfer Type': np.where(suppliers.priority[sup_idx_arr] == 1, 'ND', 'RF'),
+            'Receive Priority': np.where(receivers.priority[rcv_idx_arr] == 1, 'Emergency', 'Potential'),
+            'Original Stock': suppliers.stock[sup_idx_arr],
+            'Current Need': receivers.qty[rcv_idx_arr]
+        })
+        transfer_suggestions: List[Dict[str, Any]] = suggestions_df.to_dict('records')
         
         return transfer_suggestions
     
@@ -266,7 +323,14 @@ class TransferOptimizer:
         if not transfer_suggestions:
             return
         
-        transfer_df = pd.DataFrame(transfer_suggestions)
+        # Build only the summarised columns, column by column
+        summary_columns = ['Article', 'OM', 'Transfer Type', 'Receive Priority']
+        transfer_df = pd.DataFrame(
+            {col: [t[col] for t in transfer_suggestions] for col in summary_columns}
+        )
+        transfer_df['Transfer Qty'] = np.fromiter(
+            (t['Transfer Qty'] for t in transfer_suggestions), dtype=np.int64, count=len(transfer_suggestions)
+        )
         
         # KPI Banner
         summary_data = {
@@ -276,35 +340,50 @@ class TransferOptimizer:
         kpi_df = pd.DataFrame(summary_data)
         kpi_df.to_excel(writer, sheet_name='Statistical Summary', startrow=0, index=False)
         
+        # Factorize every summary key once; all four tables below are bincounts over
+        # these codes instead of four separate groupby passes
+        qty = transfer_df['Transfer Qty'].to_numpy()
+        art_codes, articles = pd.factorize(transfer_df['Article'], sort=True)
+        om_codes, oms = pd.factorize(transfer_df['OM'], sort=True)
+        type_codes, transfer_types = pd.factorize(transfer_df['Transfer Type'], sort=True)
+        prio_codes, receive_priorities = pd.factorize(transfer_df['Receive Priority'], sort=True)
+        # Distinct Article+OM pairs give both "OMs per Article" and "Articles per OM"
+        pairs = np.unique(art_codes.astype(np.int64) * len(oms) + om_codes)
+        
+        def qty_by(codes, n):
+            return np.bincount(codes, weights=qty, minlength=n).astype(np.int64)
+        
         # Statistics by Article
-        article_stats = transfer_df.groupby('Article').agg({
-            'Transfer Qty': 'sum',
-            'OM': 'nunique'
-        }).reset_index()
-        article_stats.columns = ['Article', 'Total Transfer Quantity', 'Number of OMs Involved']
+        article_stats = pd.DataFrame({
+            'Article': articles,
+            'Total Transfer Quantity': qty_by(art_codes, len(articles)),
+            'Number of OMs Involved': np.bincount(pairs // len(oms), minlength=len(articles))
+        })
         article_stats.to_excel(writer, sheet_name='Statistical Summary', startrow=5, index=False)
         
         # Statistics by OM
-        om_stats = transfer_df.groupby('OM').agg({
-            'Transfer Qty': 'sum',
-            'Article': 'nunique'
-        }).reset_index()
-        om_stats.columns = ['OM', 'Total Transfer Quantity', 'Number of Articles Involved']
+        om_stats = pd.DataFrame({
+            'OM': oms,
+            'Total Transfer Quantity': qty_by(om_codes, len(oms)),
+            'Number of Articles Involved': np.bincount(pairs % len(oms), minlength=len(oms))
+        })
         om_stats.to_excel(writer, sheet_name='Statistical Summary', startrow=5 + len(article_stats) + 2, index=False)
         
         # Transfer Type Analysis
-        transfer_type_stats = transfer_df.groupby('Transfer Type').agg({
-            'Transfer Qty': ['count', 'sum']
-        }).reset_index()
-        transfer_type_stats.columns = ['Transfer Type', 'Number of Suggestions', 'Total Quantity']
+        transfer_type_stats = pd.DataFrame({
+            'Transfer Type': transfer_types,
+            'Number of Suggestions': np.bincount(type_codes, minlength=len(transfer_types)),
+            'Total Quantity': qty_by(type_codes, len(transfer_types))
+        })
         transfer_type_stats.to_excel(writer, sheet_name='Statistical Summary', 
                                    startrow=5 + len(article_stats) + len(om_stats) + 4, index=False)
         
         # Receive Priority Analysis
-        priority_stats = transfer_df.groupby('Receive Priority').agg({
-            'Transfer Qty': ['count', 'sum']
-        }).reset_index()
-        priority_stats.columns = ['Receive Priority', 'Number of Suggestions', 'Total Quantity']
+        priority_stats = pd.DataFrame({
+            'Receive Priority': receive_priorities,
+            'Number of Suggestions': np.bincount(prio_codes, minlength=len(receive_priorities)),
+            'Total Quantity': qty_by(prio_codes, len(receive_priorities))
+        })
         priority_stats.to_excel(writer, sheet_name='Statistical Summary', 
                               startrow=5 + len(article_stats) + len(om_stats) + len(transfer_type_stats) + 6, 
                               index=False)
@@ -315,27 +394,43 @@ class TransferOptimizer:
             # 1. Read and validate data
             df = self.read_and_validate_data(file_path)
             
-            # 2. Identify transfer candidates
-            suppliers, receivers = self.identify_transfer_candidates(df)
+            return self._run_pipeline(df)
             
-            # 3. Match transfers
-            transfer_suggestions = self.match_transfers(suppliers, receivers)
-            
-            # 4. Quality checks
-            quality_checks = self.run_quality_checks(transfer_suggestions)
-            
-            # 5. Generate output
-            output_file = self.generate_output(df, transfer_suggestions)
-            
-            # 6. Print summary
-            self._print_summary(transfer_suggestions, quality_checks)
+        except Exception as e:
+            logger.error(f"Error processing file: {str(e)}")
+            raise
+    
+    def process_dataframe(self, df: pd.DataFrame):
+        """Process an already-loaded DataFrame (e.g. an upload parsed in memory) without re-reading the file"""
+        try:
+            # 1. Validate data
+            df = self._preprocess_data(df)
             
-            return output_file, transfer_suggestions
+            return self._run_pipeline(df)
             
         except Exception as e:
-            logger.error(f"Error processing file: {str(e)}")
+            logger.error(f"Error processing data: {str(e)}")
             raise
     
+    def _run_pipeline(self, df: pd.DataFrame):
+        """Run candidate identification, matching, checks and output on preprocessed data"""
+        # 2. Identify transfer candidates
+        suppliers, receivers = self.identify_transfer_candidates(df)
+        
+        # 3. Match transfers
+        transfer_suggestions = self.match_transfers(suppliers, receivers)
+        
+        # 4. Quality checks
+        quality_checks = self.run_quality_checks(transfer_suggestions)
+        
+        # 5. Generate output
+        output_file = self.generate_output(df, transfer_suggestions)
+        
+        # 6. Print summary
+        self._print_summary(transfer_suggestions, quality_checks)
+        
+        return output_file, transfer_suggestions
+    
     def _print_summary(self, transfer_suggestions: List[Dict[str, Any]], quality_checks: List[Dict[str, Any]]):
         """Print processing result summary"""
         print("=" * 60)
@@ -364,7 +459,7 @@ class TransferOptimizer:
 
 # Usage Example
 if __name__ == "__main__":
-    optimizer = TransferOptimizer()
+    optimizer = TransferOptimizer(cache_dir='.cache')
     
     # Process sample file
     input_file = r"C:\Users\BestO\Dropbox\SASA\ELE_08Sep2025.XLSX"
@@ -1,12 +1,39 @@
 import pandas as pd
 import numpy as np
 import streamlit as st
+import hashlib
 from io import BytesIO
-import matplotlib.pyplot as plt
-import seaborn as sns
-from matplotlib.ticker import MaxNLocator
 
+try:
+    from numba import njit
+except ImportError:  # 部署環境依 requirements.txt 安裝 numba；未安裝時退回純 Python 執行匹配核心
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# 文字欄統一使用 Arrow 儲存的 pandas 字串型別（與 transfer_system.ARROW_STRING 相同）
+ARROW_STRING = pd.StringDtype('pyarrow')
+
+# 快取為全伺服器、跨會話共用：限制條目數並設定過期時間，避免每份上傳的 DataFrame 常駐記憶體
+CACHE_TTL_SECONDS = 3600
+
+def _frame_cache_key(df):
+    """
+    以全部內容（含欄名、型別與行序）計算 DataFrame 的快取鍵。
+    Streamlit 預設對 5 萬行以上的表只抽樣 1 萬行雜湊，改動抽樣外的儲存格會命中舊結果。
+    """
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return (df.shape, tuple(map(str, df.columns)), tuple(map(str, df.dtypes)),
+            hashlib.blake2b(row_hashes.tobytes(), digest_size=16).hexdigest())
+
+CACHE_HASH_FUNCS = {pd.DataFrame: _frame_cache_key}
+
+@st.cache_data(show_spinner=False, max_entries=4, ttl=CACHE_TTL_SECONDS, hash_funcs=CACHE_HASH_FUNCS)
 def preprocess_data(df):
+    """
+    清理並驗證上傳資料。會就地修改傳入的 df（僅在快取未命中時執行），呼叫端應傳入副本。
+    """
     logs = []
     required_cols = [
         'Article', 'Article Description', 'RP Type', 'Site', 'OM',
@@ -34,145 +61,180 @@ def preprocess_data(df):
         'MOQ', 'SaSa Net Stock', 'Pending Received', 'Safety Stock',
         'Last Month Sold Qty', 'MTD Sold Qty'
     ]
+    sales_cols = ['Last Month Sold Qty', 'MTD Sold Qty']
+    # 先收集 (遮罩, 備註) 規則，最後一次性組合 Notes，避免反覆改寫整欄字串
+    note_rules = []
+    limit = 100000
+    # 每欄只轉換一次數值，所有修正規則在同一個 NumPy 陣列上完成
     for col in quantity_cols:
-        original_nan_mask = pd.to_numeric(df[col], errors='coerce').isnull()
-        if original_nan_mask.any():
-            df.loc[original_nan_mask, 'Notes'] += f'{col}非數字值已填充為0; '
-            df.loc[original_nan_mask, col] = 0
-            logs.append(f"Warning: '{col}' 欄位中的非數字值已填充為0。")
-
-        df[col] = df[col].astype(int)
+        values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        nan_mask = np.isnan(values)
+        values = np.trunc(np.nan_to_num(values, nan=0.0))
+        negative_mask = values < 0
+        # 銷量欄上限為 limit；其餘數量欄以 int32 上限為界，超出者同樣記錄備註
+        cap = limit if col in sales_cols else np.iinfo(np.int32).max
+        over_limit_mask = values > cap
 
-        negative_mask = df[col] < 0
+        if nan_mask.any():
+            note_rules.append((nan_mask, f'{col}非數字值已填充為0; '))
+            logs.append(f"Warning: '{col}' 欄位中的非數字值已填充為0。")
         if negative_mask.any():
-            df.loc[negative_mask, 'Notes'] += f'{col}負值已修正為0; '
-            df.loc[negative_mask, col] = 0
+            note_rules.append((negative_mask, f'{col}負值已修正為0; '))
             logs.append(f"Warning: '{col}' 欄位中的負值已修正為0。")
+        if over_limit_mask.any():
+            note_rules.append((over_limit_mask, f'{col}超過{cap}已限制為{cap}; '))
+            logs.append(f"Warning: '{col}' 中超過 {cap} 的值已限制為 {cap}。")
+
+        # 限制後的數量值均在 int32 範圍內，窄化後 groupby/transform 的記憶體頻寬減半
+        df[col] = np.clip(values, 0, cap).astype(np.int32)
 
-        if col in ['Last Month Sold Qty', 'MTD Sold Qty']:
-            limit = 100000
-            over_limit_mask = df[col] > limit
-            if over_limit_mask.any():
-                df.loc[over_limit_mask, 'Notes'] += f'{col}超過{limit}已限制為{limit}; '
-                df.loc[over_limit_mask, col] = limit
-                logs.append(f"Warning: '{col}' 中超過 {limit} 的值已限制為 {limit}。")
+    # 有效銷量只在預處理時計算一次，後續估算與匹配直接讀取
+    df['Effective Sold Qty'] = _effective_sold_qty(df)
 
     string_cols = ['Article Description', 'RP Type', 'Site', 'OM']
     for col in string_cols:
-        nan_mask = df[col].isnull() | (df[col] == '')
+        values = df[col].to_numpy(dtype=object)
+        nan_mask = pd.isnull(values) | (values == '')
         if nan_mask.any():
-            df.loc[nan_mask, 'Notes'] += f'{col}空值已填充; '
-            df.loc[nan_mask, col] = ''
+            note_rules.append((nan_mask, f'{col}空值已填充; '))
+            df[col] = np.where(nan_mask, '', values)
             logs.append(f"Info: '{col}' 欄位中的空值已填充。")
 
+    notes = np.full(len(df), '', dtype=object)
+    for mask, note in note_rules:
+        notes[mask] += note
+    df['Notes'] = notes
+
+    # 重複度高的鍵值欄轉為 category，groupby/比較改在整數代碼上進行
+    for col in ['Article', 'Site', 'OM']:
+        df[col] = df[col].astype('category')
+
     valid_rp_types = ['ND', 'RF']
-    invalid_rp_mask = ~df['RP Type'].isin(valid_rp_types)
+    # 固定類別為 ND/RF，無效值轉為缺失值，之後的比較均為整數代碼比較
+    df['RP Type'] = pd.Categorical(df['RP Type'], categories=valid_rp_types)
+    invalid_rp_mask = df['RP Type'].isna()
     if invalid_rp_mask.any():
         error_msg = f"錯誤: 'RP Type' 欄位包含無效值。只允許 {valid_rp_types}。"
         st.error(error_msg)
         logs.append(error_msg)
-        df = df[df['RP Type'].isin(valid_rp_types)]
+        df = df[~invalid_rp_mask]
         logs.append("Warning: 已過濾掉 'RP Type' 無效的行。")
 
     return df, logs
 
+def _effective_sold_qty(df):
+    """
+    有效銷量：上月銷量大於0時取上月，否則取本月至今銷量（直接在 ndarray 上計算）。
+    preprocess_data 已寫入此欄；未經預處理的資料由呼叫端補算。
+    """
+    last = df['Last Month Sold Qty'].to_numpy()
+    mtd = df['MTD Sold Qty'].to_numpy()
+    return np.where(last > 0, last, mtd)
+
+def _candidate_columns(df):
+    """
+    取出候選規則所需的欄位陣列（含各 Article 最高有效銷量），供各模式共用。
+    """
+    # 數量欄以 int32 儲存，讀取時放寬為 int64，避免 stock + pending 溢位
+    stock = df['SaSa Net Stock'].to_numpy(dtype=np.int64)
+    pending = df['Pending Received'].to_numpy(dtype=np.int64)
+    return {
+        'stock': stock,
+        'pending': pending,
+        'total': stock + pending,
+        'safety_stock': df['Safety Stock'].to_numpy(dtype=np.int64),
+        'effective_sales': df['Effective Sold Qty'].to_numpy(dtype=np.int64),
+        'moq': df['MOQ'].to_numpy(dtype=np.int64),
+        'max_sales_in_group': df.groupby('Article', observed=True)['Effective Sold Qty'].transform('max').to_numpy(),
+        'is_nd': (df['RP Type'] == 'ND').to_numpy(),
+        'is_rf': (df['RP Type'] == 'RF').to_numpy()
+    }
+
+def _sender_candidates(c, mode):
+    """
+    轉出候選：回傳 (類型, 優先級, 可轉出數量, 是否為候選) 陣列。
+    """
+    stock, total = c['stock'], c['total']
+    nd_mask = c['is_nd'] & (stock > 0)
+    if mode == 'A' or mode == 'C': # 在C模式下也允許RF過剩轉出
+        rf_cond = c['is_rf'] & (total > c['safety_stock']) & (c['effective_sales'] < c['max_sales_in_group'])
+        base_transferable = total - c['safety_stock']
+        upper_limit = total * 0.2
+        rf_type = 'RF過剩轉出'
+    else:
+        rf_cond = c['is_rf'] & (total > (c['moq'] + 1)) & (c['effective_sales'] < c['max_sales_in_group'])
+        base_transferable = total - (c['moq'] + 1)
+        upper_limit = total * 0.5
+        rf_type = 'RF加強轉出'
+    actual_transfer = np.minimum(np.minimum(base_transferable, np.maximum(upper_limit, 2)), stock)
+    rf_mask = rf_cond & (actual_transfer > 0)
+    sender_type = np.where(nd_mask, 'ND轉出', rf_type)
+    priority = np.where(nd_mask, 1, 2)
+    available_qty = np.where(nd_mask, stock, np.floor(np.where(rf_mask, actual_transfer, 0))).astype(np.int64)
+    return sender_type, priority, available_qty, nd_mask | rf_mask
+
+def _receiver_candidates(c, mode):
+    """
+    接收候選：回傳 (類型, 優先級, 需求數量, 是否為候選) 陣列。
+    """
+    stock, total, safety_stock, moq = c['stock'], c['total'], c['safety_stock'], c['moq']
+    if mode == 'C':
+        base_needed = np.where(safety_stock == 0, np.maximum(moq, 3), np.maximum(safety_stock * 0.5, 3))
+        needed = base_needed.astype(np.int64)
+        receiver_mask = c['is_rf'] & (total <= 1) & (needed > 0)
+        receiver_type = np.full(len(stock), 'C模式重點補0')
+        priority = np.zeros(len(stock), dtype=np.int64)
+    else:
+        shortage = c['is_rf'] & (total < safety_stock)
+        # 針對安全庫存為0但存在缺貨的店鋪，補充起始需求
+        initial = c['is_rf'] & ~shortage & (total == 0) & (safety_stock == 0)
+        # 根據庫存狀況和銷售潛力定義接收類型
+        urgent = shortage & (stock == 0) & (c['effective_sales'] > 0)
+        needed = np.where(shortage, safety_stock - total, np.maximum(moq, 3)).astype(np.int64)
+        receiver_mask = (shortage & (needed > 0)) | initial
+        receiver_type = np.select([initial, urgent], ['起始補貨需求', '緊急缺貨補貨'], default='潛在缺貨補貨')
+        priority = np.where(initial | urgent, 1, 2)
+    return receiver_type, priority, needed, receiver_mask
+
 def _calculate_candidates(df, transfer_mode):
     """
     內部輔助函數，根據業務規則識別轉出和接收候選。
     此函數不執行匹配。
     """
     mode = transfer_mode[0]  # 'A', 'B', or 'C'
-    
-    senders = []
-    receivers = []
-    
-    grouped = df.groupby('Article')
-    
-    for article, group in grouped:
-        max_sales_in_group = group['Effective Sold Qty'].max()
-        
-        sorted_group = group
-        if mode == 'B':
-            sorted_group = group.sort_values(by=['Last Month Sold Qty', 'MTD Sold Qty'], ascending=True)
-
-        for _, row in sorted_group.iterrows():
-            stock = row['SaSa Net Stock']
-            pending = row['Pending Received']
-            safety_stock = row['Safety Stock']
-            effective_sales = row['Effective Sold Qty']
-            moq = row['MOQ']
-            
-            # --- 轉出候選邏輯 ---
-            if row['RP Type'] == 'ND' and stock > 0:
-                senders.append({
-                    'type': 'ND轉出', 'priority': 1, 'data': row, 
-                    'available_qty': stock, 'current_stock': stock
-                })
-            
-            if mode == 'A' or mode == 'C': # 在C模式下也允許RF過剩轉出
-                if row['RP Type'] == 'RF' and (stock + pending) > safety_stock and effective_sales < max_sales_in_group:
-                    base_transferable = (stock + pending) - safety_stock
-                    upper_limit = (stock + pending) * 0.2
-                    actual_transfer = min(base_transferable, max(upper_limit, 2))
-                    actual_transfer = min(actual_transfer, stock)
-                    
-                    if actual_transfer > 0:
-                        senders.append({
-                            'type': 'RF過剩轉出', 'priority': 2, 'data': row,
-                            'available_qty': int(np.floor(actual_transfer)),
-                            'current_stock': stock
-                        })
-            
-            elif mode == 'B':
-                if row['RP Type'] == 'RF' and (stock + pending) > (moq + 1) and effective_sales < max_sales_in_group:
-                    base_transferable = (stock + pending) - (moq + 1)
-                    upper_limit = (stock + pending) * 0.5
-                    actual_transfer = min(base_transferable, max(upper_limit, 2))
-                    actual_transfer = min(actual_transfer, stock)
-
-                    if actual_transfer > 0:
-                        senders.append({
-                            'type': 'RF加強轉出', 'priority': 2, 'data': row,
-                            'available_qty': int(np.floor(actual_transfer)),
-                            'current_stock': stock
-                        })
-
-            # --- 接收候選邏輯 ---
-            if mode == 'C':
-                if row['RP Type'] == 'RF' and (stock + pending) <= 1:
-                    base_needed = max(row['Safety Stock'] * 0.5, 3)
-                    if row['Safety Stock'] == 0:
-                        base_needed = max(row['MOQ'], 3)
-                    needed = int(base_needed)
-                    if needed > 0:
-                        receivers.append({
-                            'type': 'C模式重點補0', 'priority': 0, 'data': row,
-                            'needed_qty': needed, 'effective_sales': effective_sales
-                        })
-            else:
-                if row['RP Type'] == 'RF':
-                    if (stock + pending) < safety_stock:
-                        needed = safety_stock - (stock + pending)
-                        if needed > 0:
-                            # 根據庫存狀況和銷售潛力定義接收類型
-                            if stock == 0 and effective_sales > 0:
-                                receivers.append({
-                                    'type': '緊急缺貨補貨', 'priority': 1, 'data': row,
-                                    'needed_qty': needed, 'effective_sales': effective_sales
-                                })
-                            else:
-                                receivers.append({
-                                    'type': '潛在缺貨補貨', 'priority': 2, 'data': row,
-                                    'needed_qty': needed, 'effective_sales': effective_sales
-                                })
-                    # 針對安全庫存為0但存在缺貨的店鋪，補充起始需求
-                    elif (stock + pending) == 0 and safety_stock == 0:
-                        needed = int(max(row['MOQ'], 3))
-                        receivers.append({
-                            'type': '起始補貨需求', 'priority': 1, 'data': row,
-                            'needed_qty': needed, 'effective_sales': effective_sales
-                        })
-                    
+
+    # 候選順序與逐組掃描一致：按 Article 排序，B模式組內再按銷量升序（穩定排序保留原始行序）
+    # 'pos' 為候選在傳入 DataFrame 中的位置，供呼叫端回查原始行
+    df = df.assign(_pos=np.arange(len(df)))
+    df = df[df['Article'].notna()]
+    # 以 Article 排序後的代碼作主鍵，一次 np.lexsort（穩定）取得排序，取代 sort_values
+    article_code = pd.factorize(df['Article'], sort=True)[0]
+    if mode == 'B':
+        order = np.lexsort((df['MTD Sold Qty'].to_numpy(), df['Last Month Sold Qty'].to_numpy(), article_code))
+    else:
+        order = np.argsort(article_code, kind='stable')
+    df = df.iloc[order]
+    c = _candidate_columns(df)
+    pos = df['_pos'].to_numpy()
+
+    sender_type, sender_priority, available_qty, sender_mask = _sender_candidates(c, mode)
+    senders = pd.DataFrame({
+        'type': sender_type,
+        'priority': sender_priority,
+        'pos': pos,
+        'available_qty': available_qty,
+        'current_stock': c['stock']
+    })[sender_mask].to_dict('records')
+
+    receiver_type, receiver_priority, needed, receiver_mask = _receiver_candidates(c, mode)
+    receivers = pd.DataFrame({
+        'type': receiver_type,
+        'priority': receiver_priority,
+        'pos': pos,
+        'needed_qty': needed,
+        'effective_sales': c['effective_sales']
+    })[receiver_mask].to_dict('records')
+
     return senders, receivers
 
 def estimate_transfer_potential(df):
@@ -180,212 +242,385 @@ def estimate_transfer_potential(df):
     為兩種模式預先計算潛在的可轉出和需求數量，
     以便在運行完整分析前向用戶展示。
     """
-    df_copy = df.copy()
-    df_copy['Effective Sold Qty'] = np.where(df_copy['Last Month Sold Qty'] > 0, df_copy['Last Month Sold Qty'], df_copy['MTD Sold Qty'])
-
-    senders_A, receivers_A = _calculate_candidates(df_copy, 'A: 保守轉貨')
-    senders_B, _ = _calculate_candidates(df_copy, 'B: 加強轉貨')
-    _, receivers_C = _calculate_candidates(df_copy, 'C: 重點補0')
-
-    total_needed_A = sum(r['needed_qty'] for r in receivers_A)
-    total_needed_C = sum(r['needed_qty'] for r in receivers_C)
-    potential_A = sum(s['available_qty'] for s in senders_A)
-    potential_B = sum(s['available_qty'] for s in senders_B)
+    # 只讀取原始資料，不再複製整個 DataFrame；未經預處理的資料才補上有效銷量
+    if 'Effective Sold Qty' not in df.columns:
+        df = df.assign(**{'Effective Sold Qty': _effective_sold_qty(df)})
+    has_article = df['Article'].notna().to_numpy()
+
+    # 各模式共用同一組欄位陣列，只對候選遮罩內的數量求和
+    c = _candidate_columns(df)
+    _, _, qty_A, mask_A = _sender_candidates(c, 'A')
+    _, _, qty_B, mask_B = _sender_candidates(c, 'B')
+    _, _, needed_A, recv_mask_A = _receiver_candidates(c, 'A')
+    _, _, needed_C, recv_mask_C = _receiver_candidates(c, 'C')
 
     return {
-        "potential_transfer_A": int(potential_A),
-        "potential_transfer_B": int(potential_B),
-        "total_needed_A": int(total_needed_A),
-        "total_needed_C": int(total_needed_C)
+        "potential_transfer_A": int(qty_A[mask_A & has_article].sum()),
+        "potential_transfer_B": int(qty_B[mask_B & has_article].sum()),
+        "total_needed_A": int(needed_A[recv_mask_A & has_article].sum()),
+        "total_needed_C": int(needed_C[recv_mask_C & has_article].sum())
     }
 
 def identify_sources(df, transfer_mode):
-    out = []
-    for _, r in df.iterrows():
-        total = int(r['SaSa Net Stock']) + int(r['Pending Received'])
-        stock = int(r['SaSa Net Stock'])
-        safety = int(r['Safety Stock'])
-        rp = str(r['RP Type'])
-        if rp == 'ND' and stock > 0:
-            out.append({'site': r['Site'], 'om': r['OM'], 'rp_type': rp, 'transferable_qty': int(stock), 'priority': 1, 'original_stock': stock, 'effective_sold_qty': int(r['Effective Sold Qty']), 'source_type': 'ND轉出', 'row': r})
-        if rp == 'RF' and stock > 0:
-            if transfer_mode.startswith('A'):
-                base = max(0, total - safety)
-                upper = max(int(total * 0.4), 2)
-                qty = min(base, upper, stock)
-                if qty > 0 and (stock - qty + int(r['Pending Received'])) >= safety:
-                    out.append({'site': r['Site'], 'om': r['OM'], 'rp_type': rp, 'transferable_qty': int(qty), 'priority': 2, 'original_stock': stock, 'effective_sold_qty': int(r['Effective Sold Qty']), 'source_type': 'RF過剩轉出', 'row': r})
-            elif transfer_mode.startswith('B'):
-                base = max(0, total - safety)
-                upper = max(int(total * 0.8), 2)
-                qty = min(max(0, upper), stock)
-                if qty > 0:
-                    remaining_total = stock - qty + int(r['Pending Received'])
-                    stype = 'RF過剩轉出' if remaining_total >= safety else 'RF加強轉出'
-                    out.append({'site': r['Site'], 'om': r['OM'], 'rp_type': rp, 'transferable_qty': int(qty), 'priority': 2, 'original_stock': stock, 'effective_sold_qty': int(r['Effective Sold Qty']), 'source_type': stype, 'row': r})
-            else:
-                upper = max(1, int(total * 0.5))
-                qty = min(upper, stock)
-                if qty > 0:
-                    remaining_total = stock - qty + int(r['Pending Received'])
-                    stype = 'RF過剩轉出' if remaining_total >= safety else 'RF加強轉出'
-                    out.append({'site': r['Site'], 'om': r['OM'], 'rp_type': rp, 'transferable_qty': int(qty), 'priority': 2, 'original_stock': stock, 'effective_sold_qty': int(r['Effective Sold Qty']), 'source_type': stype, 'row': r})
-    return out
+    """
+    以整欄 NumPy 運算識別轉出來源，只回傳符合條件的候選行。
+    """
+    stock = df['SaSa Net Stock'].to_numpy(dtype=np.int64)
+    pending = df['Pending Received'].to_numpy(dtype=np.int64)
+    safety = df['Safety Stock'].to_numpy(dtype=np.int64)
+    eff = df['Effective Sold Qty'].to_numpy(dtype=np.int64)
+    is_nd = (df['RP Type'] == 'ND').to_numpy()
+    is_rf = (df['RP Type'] == 'RF').to_numpy()
+    total = stock + pending
+
+    nd_mask = is_nd & (stock > 0)
+    rf_mask = is_rf & (stock > 0)
+    if transfer_mode.startswith('A'):
+        base = np.maximum(0, total - safety)
+        upper = np.maximum((total * 0.4).astype(np.int64), 2)
+        rf_qty = np.minimum.reduce([base, upper, stock])
+        rf_mask &= (rf_qty > 0) & ((stock - rf_qty + pending) >= safety)
+        rf_type = np.full(len(df), 'RF過剩轉出')
+    else:
+        if transfer_mode.startswith('B'):
+            upper = np.maximum((total * 0.8).astype(np.int64), 2)
+            rf_qty = np.minimum(np.maximum(0, upper), stock)
+        else:
+            upper = np.maximum(1, (total * 0.5).astype(np.int64))
+            rf_qty = np.minimum(upper, stock)
+        rf_mask &= rf_qty > 0
+        remaining_total = stock - rf_qty + pending
+        rf_type = np.where(remaining_total >= safety, 'RF過剩轉出', 'RF加強轉出')
+
+    sources = pd.DataFrame({
+        'site': df['Site'].to_numpy(),
+        'om': df['OM'].to_numpy(),
+        'rp_type': np.where(is_nd, 'ND', 'RF'),
+        'transferable_qty': np.where(nd_mask, stock, rf_qty),
+        'priority': np.where(nd_mask, 1, 2),
+        'original_stock': stock,
+        'effective_sold_qty': eff,
+        'source_type': np.where(nd_mask, 'ND轉出', rf_type),
+        'pos': np.arange(len(df))
+    })
+    return sources[nd_mask | rf_mask]
 
 def identify_destinations(df, transfer_mode):
-    out = []
-    max_sales = df.groupby('Article')['Effective Sold Qty'].max().to_dict()
-    for _, r in df.iterrows():
-        if str(r['RP Type']) != 'RF':
-            continue
-        stock = int(r['SaSa Net Stock'])
-        pending = int(r['Pending Received'])
-        total = stock + pending
-        safety = int(r['Safety Stock'])
-        eff = int(r['Effective Sold Qty'])
-        need = 0
-        dtype = None
-        tgt = 0
-        recvd = 0
-        if transfer_mode.startswith('C') and total <= 1:
-            tgt = max(int(safety * 0.5), 3)
-            need = max(0, tgt - total)
-            if need > 0:
-                dtype = 'C模式重點補0'
-        else:
-            if total < safety:
-                need = safety - total
-                if stock == 0 and eff > 0:
-                    dtype = '緊急缺貨補貨'
-                else:
-                    if eff >= max_sales.get(r['Article'], eff):
-                        dtype = '潛在缺貨補貨'
-        if dtype and need > 0:
-            pri = 1 if dtype == '緊急缺貨補貨' else 2
-            out.append({'site': r['Site'], 'om': r['OM'], 'rp_type': 'RF', 'needed_qty': int(need), 'priority': pri, 'current_stock': stock, 'pending_received': pending, 'safety_stock': safety, 'moq': int(r['MOQ']), 'effective_sold_qty': eff, 'dest_type': dtype, 'target_qty': tgt, 'received_qty': recvd, 'row': r})
-    return out
+    """
+    以整欄 NumPy 運算識別接收目標（僅RF），只回傳有需求的候選行。
+    """
+    stock = df['SaSa Net Stock'].to_numpy(dtype=np.int64)
+    pending = df['Pending Received'].to_numpy(dtype=np.int64)
+    safety = df['Safety Stock'].to_numpy(dtype=np.int64)
+    eff = df['Effective Sold Qty'].to_numpy(dtype=np.int64)
+    is_rf = (df['RP Type'] == 'RF').to_numpy()
+    total = stock + pending
+    max_sales = df['Effective Sold Qty'].groupby(pd.factorize(df['Article'])[0], sort=False).transform('max').to_numpy()
+
+    if transfer_mode.startswith('C'):
+        zero_fill = total <= 1
+    else:
+        zero_fill = np.zeros(len(df), dtype=bool)
+    tgt = np.where(zero_fill, np.maximum((safety * 0.5).astype(np.int64), 3), 0)
+    shortage = ~zero_fill & (total < safety)
+    urgent = shortage & (stock == 0) & (eff > 0)
+    potential = shortage & ~urgent & (eff >= max_sales)
+    need = np.where(zero_fill, np.maximum(0, tgt - total), safety - total)
+    dest_type = np.select([zero_fill, urgent, potential], ['C模式重點補0', '緊急缺貨補貨', '潛在缺貨補貨'], default='')
+
+    destinations = pd.DataFrame({
+        'site': df['Site'].to_numpy(),
+        'om': df['OM'].to_numpy(),
+        'rp_type': 'RF',
+        'needed_qty': need,
+        'priority': np.where(urgent, 1, 2),
+        'current_stock': stock,
+        'pending_received': pending,
+        'safety_stock': safety,
+        'moq': df['MOQ'].to_numpy(dtype=np.int64),
+        'effective_sold_qty': eff,
+        'dest_type': dest_type,
+        'target_qty': tgt,
+        'received_qty': 0,
+        'pos': np.arange(len(df))
+    })
+    return destinations[is_rf & (dest_type != '') & (need > 0)]
+
+# 轉出/接收類型的整數編碼及配對順位表（列：轉出類型，欄：接收類型；99 為最低優先，仍會配對，只排在最後）
+SOURCE_TYPES = ['ND轉出', 'RF過剩轉出', 'RF加強轉出']
+DEST_TYPES = ['緊急缺貨補貨', '潛在缺貨補貨', 'C模式重點補0']
+PAIR_RANK = np.array([
+    [1, 2, 99],
+    [3, 4, 7],
+    [5, 6, 7]
+], dtype=np.int64)
+
+MATCH_LOCK_CELLS = 1 << 24  # 單段匹配鎖定位元圖的最大 Article x Site 格數（約2MB）
+
+@njit(cache=True)
+def _site_locked(locked, art, site):
+    """
+    鎖定位元圖中每個 Article 佔一列 uint64，第 site 位元表示該店鋪已鎖定。
+    """
+    return (locked[art, site >> 6] >> np.uint64(site & 63)) & np.uint64(1) != 0
+
+@njit(cache=True)
+def _lock_site(locked, art, site):
+    locked[art, site >> 6] |= np.uint64(1) << np.uint64(site & 63)
 
+@njit(cache=True)
+def _match_kernel(s_article, s_site, s_type, s_avail, d_site, d_need, bucket_lo, bucket_hi, bucket_order, rank, n_article, n_site):
+    """
+    匹配核心：每個轉出來源在同 Article/OM 的接收目標中，挑選 (配對順位, 排序位置) 最小且未鎖定的一個。
+    回傳匹配數量及 (來源索引, 目標索引, 數量, 目標累計接收量) 陣列。
+    """
+    locked = np.zeros((n_article, (n_site + 63) >> 6), dtype=np.uint64)
+    d_received = np.zeros(d_need.shape[0], dtype=np.int64)
+    out_src = np.empty(s_avail.shape[0], dtype=np.int64)
+    out_dst = np.empty(s_avail.shape[0], dtype=np.int64)
+    out_qty = np.empty(s_avail.shape[0], dtype=np.int64)
+    out_received = np.empty(s_avail.shape[0], dtype=np.int64)
+    k = 0
+    for i in range(s_avail.shape[0]):
+        art = s_article[i]
+        if s_avail[i] <= 0 or _site_locked(locked, art, s_site[i]):
+            continue
+        best = -1
+        best_rank = 0
+        for b in range(bucket_lo[i], bucket_hi[i]):
+            j = bucket_order[b]
+            if d_site[j] == s_site[i] or d_need[j] <= 0 or _site_locked(locked, art, d_site[j]):
+                continue
+            if best < 0 or rank[s_type[i], j] < best_rank:
+                best = j
+                best_rank = rank[s_type[i], j]
+        if best < 0:
+            continue
+        qty = min(s_avail[i], d_need[best])
+        s_avail[i] -= qty
+        d_need[best] -= qty
+        d_received[best] += qty
+        _lock_site(locked, art, s_site[i])
+        _lock_site(locked, art, d_site[best])
+        out_src[k] = i
+        out_dst[k] = best
+        out_qty[k] = qty
+        out_received[k] = d_received[best]
+        k += 1
+    return k, out_src, out_dst, out_qty, out_received
+
+@st.cache_data(show_spinner=False, max_entries=12, ttl=CACHE_TTL_SECONDS, hash_funcs=CACHE_HASH_FUNCS)
 def generate_recommendations(df, transfer_mode):
-    recommendations = []
-    df['Effective Sold Qty'] = np.where(df['Last Month Sold Qty'] > 0, df['Last Month Sold Qty'], df['MTD Sold Qty'])
+    """
+    生成調貨建議與統計。未經預處理的 df 會被就地補上有效銷量欄，呼叫端應傳入副本。
+    """
+    if 'Effective Sold Qty' not in df.columns:
+        df['Effective Sold Qty'] = _effective_sold_qty(df)
     sources = identify_sources(df, transfer_mode)
     destinations = identify_destinations(df, transfer_mode)
-    destinations = [d for d in destinations if d['rp_type'] == 'RF']
-    def pair_rank(s, d):
-        order = {
-            ('ND轉出','緊急缺貨補貨'): 1,
-            ('ND轉出','潛在缺貨補貨'): 2,
-            ('RF過剩轉出','緊急缺貨補貨'): 3,
-            ('RF過剩轉出','潛在缺貨補貨'): 4,
-            ('RF加強轉出','緊急缺貨補貨'): 5,
-            ('RF加強轉出','潛在缺貨補貨'): 6,
-            ('RF過剩轉出','C模式重點補0'): 7,
-            ('RF加強轉出','C模式重點補0'): 7
-        }
-        return order.get((s['source_type'], d['dest_type']), 99)
-    sources.sort(key=lambda x: (x['priority'], -x['effective_sold_qty'], -x['transferable_qty']))
-    destinations.sort(key=lambda x: (x['priority'], x['effective_sold_qty'], -x['current_stock']))
-    locked = {}
-    for s in sources:
-        art = s['row']['Article']
-        if art not in locked:
-            locked[art] = set()
-        cand = [d for d in destinations if d['row']['Article']==art and d['om']==s['om'] and d['site']!=s['site']]
-        for d in sorted(cand, key=lambda x: pair_rank(s,x)):
-            if s['transferable_qty'] <= 0 or d['needed_qty'] <= 0:
-                continue
-            if s['site'] in locked[art] or d['site'] in locked[art]:
-                continue
-            qty = min(int(s['transferable_qty']), int(d['needed_qty']))
-            if qty <= 0:
-                continue
-            s['transferable_qty'] -= qty
-            d['needed_qty'] -= qty
-            d['received_qty'] += qty
-            locked[art].add(s['site'])
-            locked[art].add(d['site'])
-            sender_type = s['source_type']
-            receiver_type = d['dest_type']
-            cap_pct = 0.4 if transfer_mode.startswith('A') else (0.8 if transfer_mode.startswith('B') else 0.5)
-            src_total = int(s['row']['SaSa Net Stock']) + int(s['row']['Pending Received'])
-            dst_total = int(d['current_stock']) + int(d['pending_received'])
-            dst_need = int(d['safety_stock']) - dst_total if d['dest_type'] in ('緊急缺貨補貨','潛在缺貨補貨') else max(0, d['target_qty'] - dst_total)
-            notes = f"Mode={transfer_mode.split(':')[0]} | Source[{sender_type}, rp={s['rp_type']}, total={src_total}, safety={int(s['row']['Safety Stock'])}, cap={int(cap_pct*100)}%] -> Dest[{receiver_type}, total={dst_total}, safety={int(d['safety_stock'])}, need={dst_need}] | qty={qty}"
-            rec = {
-                'Article': s['row']['Article'],
-                'Product Desc': s['row']['Article Description'],
-                'Transfer OM': s['om'],
-                'Transfer Site': s['site'],
-                'Receive OM': d['om'],
-                'Receive Site': d['site'],
-                'Transfer Qty': qty,
-                'Original Stock': s['original_stock'],
-                'Receive Original Stock': int(d['current_stock']),
-                'After Transfer Stock': s['original_stock'] - qty,
-                'Safety Stock': int(s['row']['Safety Stock']),
-                'MOQ': int(s['row']['MOQ']),
-                'Source Last Month Sold Qty': int(s['row']['Last Month Sold Qty']),
-                'Source MTD Sold Qty': int(s['row']['MTD Sold Qty']),
-                'Receive Last Month Sold Qty': int(d['row']['Last Month Sold Qty']),
-                'Receive MTD Sold Qty': int(d['row']['MTD Sold Qty']),
-                'Source Type': sender_type,
-                'Destination Type': receiver_type,
-                'Cumulative Received Qty': d['received_qty'],
-                'Target Qty': d['target_qty'],
-                'Remark': f"{sender_type} -> {receiver_type}",
-                'Notes': notes,
-                '_sender_type': sender_type,
-                '_receiver_type': receiver_type,
-                'OM': s['om']
-            }
-            recommendations.append(rec)
-    if not recommendations:
+    # 以平行陣列(SoA)保存候選，排序一次後以整數索引存取
+    s_order = np.lexsort((-sources['transferable_qty'].to_numpy(), -sources['effective_sold_qty'].to_numpy(), sources['priority'].to_numpy()))
+    sources = sources.iloc[s_order]
+    s_pos = sources['pos'].to_numpy()
+    s_site = sources['site'].to_numpy()
+    s_om = sources['om'].to_numpy()
+    s_rp = sources['rp_type'].to_numpy()
+    s_type = sources['source_type'].to_numpy()
+    s_stock = sources['original_stock'].to_numpy()
+    s_avail = sources['transferable_qty'].to_numpy().astype(np.int64)
+    d_order = np.lexsort((-destinations['current_stock'].to_numpy(), destinations['effective_sold_qty'].to_numpy(), destinations['priority'].to_numpy()))
+    destinations = destinations.iloc[d_order]
+    d_pos = destinations['pos'].to_numpy()
+    d_site = destinations['site'].to_numpy()
+    d_om = destinations['om'].to_numpy()
+    d_type = destinations['dest_type'].to_numpy()
+    d_stock = destinations['current_stock'].to_numpy()
+    d_pending = destinations['pending_received'].to_numpy()
+    d_safety = destinations['safety_stock'].to_numpy()
+    d_target = destinations['target_qty'].to_numpy()
+    d_need = destinations['needed_qty'].to_numpy().astype(np.int64)
+    # 按位置讀取原始欄位，避免在匹配迴圈中逐筆存取 pandas Series
+    article = df['Article'].to_numpy()
+    article_desc = df['Article Description'].to_numpy()
+    net_stock = df['SaSa Net Stock'].to_numpy()
+    pending_received = df['Pending Received'].to_numpy()
+    safety_stock = df['Safety Stock'].to_numpy()
+    moq = df['MOQ'].to_numpy()
+    last_month_sold = df['Last Month Sold Qty'].to_numpy()
+    mtd_sold = df['MTD Sold Qty'].to_numpy()
+    # 將 Article/Site/OM 轉為整數代碼，匹配核心只處理整數陣列
+    article_code, article_uniques = pd.factorize(df['Article'], use_na_sentinel=False)
+    site_code, site_uniques = pd.factorize(df['Site'], use_na_sentinel=False)
+    om_code, om_uniques = pd.factorize(df['OM'], use_na_sentinel=False)
+    n_om = max(len(om_uniques), 1)
+    s_key = article_code[s_pos].astype(np.int64) * n_om + om_code[s_pos]
+    d_key = article_code[d_pos].astype(np.int64) * n_om + om_code[d_pos]
+    # 接收目標按 (Article, OM) 分桶，桶內保持既有排序
+    bucket_order = np.argsort(d_key, kind='stable')
+    sorted_key = d_key[bucket_order]
+    bucket_lo = np.searchsorted(sorted_key, s_key, side='left')
+    bucket_hi = np.searchsorted(sorted_key, s_key, side='right')
+    # 每種轉出類型對所有接收目標的配對順位
+    s_type_code = pd.Categorical(s_type, categories=SOURCE_TYPES).codes
+    d_type_code = pd.Categorical(d_type, categories=DEST_TYPES).codes
+    rank = PAIR_RANK[:, d_type_code]
+    # 同 Article/OM 內沒有任何接收目標的來源不可能匹配，直接略過
+    active = np.flatnonzero(bucket_hi > bucket_lo)
+    active_pos = s_pos[active]
+    active_article = article_code[active_pos].astype(np.int64)
+    active_site = site_code[active_pos].astype(np.int64)
+    active_type = s_type_code[active].astype(np.int64)
+    active_avail = s_avail[active]
+    active_lo = bucket_lo[active].astype(np.int64)
+    active_hi = bucket_hi[active].astype(np.int64)
+    d_site_code = site_code[d_pos].astype(np.int64)
+    bucket_order = bucket_order.astype(np.int64)
+    # 匹配只在同一 Article 內進行，按 Article 代碼分段執行核心，
+    # 使鎖定位元圖 (Article x Site) 的大小受 MATCH_LOCK_CELLS 限制
+    n_article = max(len(article_uniques), 1)
+    n_site = max(len(site_uniques), 1)
+    chunk_articles = max(1, MATCH_LOCK_CELLS // n_site)
+    pieces = []
+    for lo in range(0, n_article, chunk_articles):
+        hi = min(lo + chunk_articles, n_article)
+        sel = np.flatnonzero((active_article >= lo) & (active_article < hi))
+        if sel.size == 0:
+            continue
+        k, c_src, c_dst, c_qty, c_received = _match_kernel(
+            active_article[sel] - lo, active_site[sel], active_type[sel], active_avail[sel],
+            d_site_code, d_need, active_lo[sel], active_hi[sel], bucket_order,
+            rank, hi - lo, n_site
+        )
+        pieces.append((active[sel[c_src[:k]]], c_dst[:k], c_qty[:k], c_received[:k]))
+    if not pieces or sum(len(p[0]) for p in pieces) == 0:
         return pd.DataFrame(), {}, pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
-    rec_df = pd.DataFrame(recommendations)
-    rec_df = rec_df[(rec_df['Transfer Qty'] > 0) & (rec_df['After Transfer Stock'] >= 0)]
-    rec_df = rec_df[rec_df['Transfer Site'] != rec_df['Receive Site']]
+    out_src, out_dst, out_qty, out_received = (np.concatenate(cols) for cols in zip(*pieces))
+    # 各段結果按來源的全域排序位置合併，與單次匹配的輸出順序一致
+    merge_order = np.argsort(out_src, kind='stable')
+    out_src = out_src[merge_order]
+    out_dst = out_dst[merge_order]
+    out_qty = out_qty[merge_order]
+    out_received = out_received[merge_order]
+    # 由匹配結果的索引陣列整欄組裝建議表，不再逐筆建立 dict
+    cap_pct = 0.4 if transfer_mode.startswith('A') else (0.8 if transfer_mode.startswith('B') else 0.5)
+    sp = s_pos[out_src]
+    dp = d_pos[out_dst]
+    sender_type = s_type[out_src]
+    receiver_type = d_type[out_dst]
+    original_stock = s_stock[out_src].astype(np.int64)
+    src_total = net_stock[sp].astype(np.int64) + pending_received[sp]
+    dst_total = d_stock[out_dst].astype(np.int64) + d_pending[out_dst]
+    dst_need = np.where(np.isin(receiver_type, ['緊急缺貨補貨','潛在缺貨補貨']), d_safety[out_dst] - dst_total, np.maximum(0, d_target[out_dst] - dst_total))
+    mode_tag = transfer_mode.split(':')[0]
+    notes = [
+        f"Mode={mode_tag} | Source[{src_t}, rp={rp}, total={s_total}, safety={s_safe}, cap={int(cap_pct*100)}%] -> Dest[{dst_t}, total={d_total}, safety={d_safe}, need={need}] | qty={qty}"
+        for src_t, rp, s_total, s_safe, dst_t, d_total, d_safe, need, qty in zip(
+            sender_type, s_rp[out_src], src_total.tolist(), safety_stock[sp].tolist(), receiver_type,
+            dst_total.tolist(), d_safety[out_dst].tolist(), dst_need.tolist(), out_qty.tolist()
+        )
+    ]
+    # 明確指定各欄型別：數量為 int32，文字欄為 Arrow string，避免 DataFrame 建構時逐欄推斷
+    qty_dtype = 'int32'
+    remark = [f"{a} -> {b}" for a, b in zip(sender_type, receiver_type)]
+    rec_df = pd.DataFrame({
+        'Article': article[sp],
+        'Product Desc': pd.array(article_desc[sp], dtype=ARROW_STRING),
+        'Transfer OM': s_om[out_src],
+        'Transfer Site': s_site[out_src],
+        'Receive OM': d_om[out_dst],
+        'Receive Site': d_site[out_dst],
+        'Transfer Qty': pd.array(out_qty, dtype=qty_dtype),
+        'Original Stock': pd.array(original_stock, dtype=qty_dtype),
+        'Receive Original Stock': pd.array(d_stock[out_dst], dtype=qty_dtype),
+        'After Transfer Stock': pd.array(original_stock - out_qty, dtype=qty_dtype),
+        'Safety Stock': pd.array(safety_stock[sp], dtype=qty_dtype),
+        'MOQ': pd.array(moq[sp], dtype=qty_dtype),
+        'Source Last Month Sold Qty': pd.array(last_month_sold[sp], dtype=qty_dtype),
+        'Source MTD Sold Qty': pd.array(mtd_sold[sp], dtype=qty_dtype),
+        'Receive Last Month Sold Qty': pd.array(last_month_sold[dp], dtype=qty_dtype),
+        'Receive MTD Sold Qty': pd.array(mtd_sold[dp], dtype=qty_dtype),
+        'Source Type': pd.array(sender_type, dtype=ARROW_STRING),
+        'Destination Type': pd.array(receiver_type, dtype=ARROW_STRING),
+        'Cumulative Received Qty': pd.array(out_received, dtype=qty_dtype),
+        'Target Qty': pd.array(d_target[out_dst], dtype=qty_dtype),
+        'Remark': pd.array(remark, dtype=ARROW_STRING),
+        'Notes': pd.array(notes, dtype=ARROW_STRING),
+        '_sender_type': pd.array(sender_type, dtype=ARROW_STRING),
+        '_receiver_type': pd.array(receiver_type, dtype=ARROW_STRING),
+        'OM': s_om[out_src]
+    })
+    # 各統計表共用一次分解的鍵值代碼，以 bincount 彙總，取代五次獨立的 groupby
+    qty = rec_df['Transfer Qty'].to_numpy(dtype=np.int64)
+    art_codes, art_keys = pd.factorize(rec_df['Article'], sort=True)
+    om_codes, om_keys = pd.factorize(rec_df['OM'], sort=True)
+    sender_codes, sender_keys = pd.factorize(rec_df['_sender_type'], sort=True)
+    receiver_codes, receiver_keys = pd.factorize(rec_df['_receiver_type'], sort=True)
+    # 不重複的 Article+OM 組合同時給出「每個 Article 涉及的 OM 數」與「每個 OM 涉及的 Article 數」
+    pairs = np.unique(art_codes.astype(np.int64) * len(om_keys) + om_codes)
+
+    def qty_by(codes, n):
+        return np.bincount(codes, weights=qty, minlength=n).astype(np.int64)
+
     kpi_metrics = {
         "總調貨建議行數": len(rec_df),
-        "總調貨件數": int(rec_df['Transfer Qty'].sum()),
-        "涉及產品數量": int(rec_df['Article'].nunique()),
-        "涉及OM數量": int(rec_df['OM'].nunique())
+        "總調貨件數": int(qty.sum()),
+        "涉及產品數量": len(art_keys),
+        "涉及OM數量": len(om_keys)
     }
-    stats_by_article = rec_df.groupby('Article').agg(
-        總調貨件數=('Transfer Qty','sum'),
-        調貨行數=('Article','count'),
-        涉及OM數量=('OM','nunique')
-    ).reset_index().round(2)
-    stats_by_om = rec_df.groupby('OM').agg(
-        總調貨件數=('Transfer Qty','sum'),
-        調貨行數=('OM','count'),
-        涉及Article數量=('Article','nunique')
-    ).reset_index().round(2)
-    transfer_type_dist = rec_df.groupby('_sender_type').agg(總件數=('Transfer Qty','sum'), 建議數量=('_sender_type','count')).reset_index().round(2)
-    receive_type_dist = rec_df.groupby('_receiver_type').agg(總件數=('Transfer Qty','sum'), 建議數量=('_receiver_type','count')).reset_index().round(2)
+    stats_by_article = pd.DataFrame({
+        'Article': art_keys,
+        '總調貨件數': qty_by(art_codes, len(art_keys)),
+        '調貨行數': np.bincount(art_codes, minlength=len(art_keys)),
+        '涉及OM數量': np.bincount(pairs // len(om_keys), minlength=len(art_keys))
+    })
+    stats_by_om = pd.DataFrame({
+        'OM': om_keys,
+        '總調貨件數': qty_by(om_codes, len(om_keys)),
+        '調貨行數': np.bincount(om_codes, minlength=len(om_keys)),
+        '涉及Article數量': np.bincount(pairs % len(om_keys), minlength=len(om_keys))
+    })
+    transfer_type_dist = pd.DataFrame({
+        '_sender_type': sender_keys,
+        '總件數': qty_by(sender_codes, len(sender_keys)),
+        '建議數量': np.bincount(sender_codes, minlength=len(sender_keys))
+    })
+    receive_type_dist = pd.DataFrame({
+        '_receiver_type': receiver_keys,
+        '總件數': qty_by(receiver_codes, len(receiver_keys)),
+        '建議數量': np.bincount(receiver_codes, minlength=len(receiver_keys))
+    })
     return rec_df, kpi_metrics, stats_by_article, stats_by_om, transfer_type_dist, receive_type_dist
 
-def create_om_transfer_chart(recommendations_df, transfer_mode):
-    if recommendations_df.empty:
-        return plt.figure()
+@st.cache_data(show_spinner=False, max_entries=12, ttl=CACHE_TTL_SECONDS, hash_funcs=CACHE_HASH_FUNCS)
+def _om_chart_data(recommendations_df, transfer_mode):
+    """
+    彙總 OM 圖表的轉出/接收數量表。只快取此資料表，圖形本身每次重新繪製，
+    避免快取命中時反覆還原出由 pyplot 管理、無人關閉的 Figure。
+    """
+    df = recommendations_df
 
-    df = recommendations_df.copy()
+    # 轉出/接收各做一次 OM x 類型 的樞紐匯總，取代逐類型篩選後 groupby
+    sender_qty = df.pivot_table(index='OM', columns='_sender_type', values='Transfer Qty', aggfunc='sum')
+    receiver_qty = df.pivot_table(index='OM', columns='_receiver_type', values='Transfer Qty', aggfunc='sum')
 
-    nd_transfer = df[df['_sender_type'] == 'ND轉出'].groupby('OM')['Transfer Qty'].sum()
-    rf_surplus_transfer = df[df['_sender_type'] == 'RF過剩轉出'].groupby('OM')['Transfer Qty'].sum()
+    def qty_of(pivot, *types):
+        cols = [t for t in types if t in pivot.columns]
+        if not cols:
+            return pd.Series(dtype=float)
+        return pivot[cols].sum(axis=1, min_count=1)
 
     transfer_data_dict = {
-        'ND Transfer Out': nd_transfer,
-        'RF Surplus Transfer Out': rf_surplus_transfer
+        'ND Transfer Out': qty_of(sender_qty, 'ND轉出'),
+        'RF Surplus Transfer Out': qty_of(sender_qty, 'RF過剩轉出')
     }
 
     if transfer_mode.startswith('B'):
-        rf_enhanced_transfer = df[df['_sender_type'] == 'RF加強轉出'].groupby('OM')['Transfer Qty'].sum()
-        transfer_data_dict['RF Enhanced Transfer Out'] = rf_enhanced_transfer
+        transfer_data_dict['RF Enhanced Transfer Out'] = qty_of(sender_qty, 'RF加強轉出')
         
-    urgent_receive = df[df['_receiver_type'] == '緊急缺貨補貨'].groupby('OM')['Transfer Qty'].sum()
-    potential_receive = df[df['_receiver_type'] == '潛在缺貨補貨'].groupby('OM')['Transfer Qty'].sum()
-    c_mode_receive = df[df['_receiver_type'] == 'C模式重點補0'].groupby('OM')['Transfer Qty'].sum()
-    initial_receive = df[df['_receiver_type'].isin(['起始補貨需求', 'ND起始補貨'])].groupby('OM')['Transfer Qty'].sum()
+    urgent_receive = qty_of(receiver_qty, '緊急缺貨補貨')
+    potential_receive = qty_of(receiver_qty, '潛在缺貨補貨')
+    c_mode_receive = qty_of(receiver_qty, 'C模式重點補0')
+    initial_receive = qty_of(receiver_qty, '起始補貨需求', 'ND起始補貨')
 
     all_oms = df['OM'].unique()
     
@@ -401,20 +636,26 @@ def create_om_transfer_chart(recommendations_df, transfer_mode):
 
     receive_data = pd.DataFrame(receive_data_dict).reindex(all_oms).fillna(0)
     
-    chart_data = pd.concat([transfer_data, receive_data], axis=1).fillna(0)
+    return pd.concat([transfer_data, receive_data], axis=1).fillna(0)
+
+def create_om_transfer_chart(recommendations_df, transfer_mode):
+    # 繪圖套件僅在需要圖表時才載入，縮短 import utils 的啟動時間
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import MaxNLocator
+
+    if recommendations_df.empty:
+        return plt.figure()
+
+    chart_data = _om_chart_data(recommendations_df, transfer_mode)
 
     fig, ax = plt.subplots(figsize=(18, 10))
     
     chart_data.plot(kind='bar', ax=ax, width=0.8)
 
-    for p in ax.patches:
-        if p.get_height() > 0:
-            ax.annotate(f'{int(p.get_height())}', 
-                        (p.get_x() + p.get_width() / 2., p.get_height()), 
-                        ha='center', va='center', 
-                        xytext=(0, 9), 
-                        textcoords='offset points',
-                        fontsize=9)
+    # 每個系列一次 bar_label 批次標註，數量為 0 的柱不顯示數字
+    for container in ax.containers:
+        labels = [f'{int(h)}' if h > 0 else '' for h in container.datavalues]
+        ax.bar_label(container, labels=labels, padding=4, fontsize=9)
 
     ax.set_title('OM Transfer vs Receive Analysis', fontsize=18, weight='bold')
     ax.set_xlabel('OM Unit', fontsize=14)
@@ -430,83 +671,100 @@ def create_om_transfer_chart(recommendations_df, transfer_mode):
     plt.tight_layout()
     return fig
 
+# 調貨建議工作表各欄寬度（依 column_order 順序）
+REC_COLUMN_WIDTHS = [15, 30, 15, 15, 15, 15, 12, 15, 18, 12, 8, 12, 14, 14, 14, 14, 35, 60]
+
+def _excel_value(v):
+    """
+    轉為 xlsxwriter 可直接寫入的 Python 值；NaN/None 寫為空白儲存格（與 to_excel 一致）。
+    """
+    if v is None or v is pd.NA or (isinstance(v, float) and np.isnan(v)):
+        return None
+    if isinstance(v, np.generic):
+        return v.item()
+    return v
+
 def generate_excel_export(rec_df, kpis, stats_article, stats_om, transfer_dist, receive_dist, transfer_mode):
+    import xlsxwriter
+
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        column_order = [
-            'Article', 'Product Desc', 'Transfer OM', 'Transfer Site', 'Receive OM', 'Receive Site',
-            'Transfer Qty', 'Original Stock', 'Receive Original Stock', 'After Transfer Stock', 'Safety Stock', 'MOQ',
-            'Source Last Month Sold Qty', 'Source MTD Sold Qty',
-            'Receive Last Month Sold Qty', 'Receive MTD Sold Qty',
-            'Remark', 'Notes'
-        ]
-
-        export_rec_df = rec_df.copy()
-        for col in column_order:
-            if col not in export_rec_df.columns:
-                export_rec_df[col] = ''
-
-        export_rec_df = export_rec_df[column_order]
-        export_rec_df.to_excel(writer, sheet_name='調貨建議', index=False)
-        ws = writer.sheets['調貨建議']
-        ws.set_column(0, 0, 15)
-        ws.set_column(1, 1, 30)
-        ws.set_column(2, 2, 15)
-        ws.set_column(3, 3, 15)
-        ws.set_column(4, 4, 15)
-        ws.set_column(5, 5, 15)
-        ws.set_column(6, 6, 12)
-        ws.set_column(7, 7, 15)
-        ws.set_column(8, 8, 18)
-        ws.set_column(9, 9, 12)
-        ws.set_column(10, 10, 8)
-        ws.set_column(11, 11, 12)
-        ws.set_column(12, 12, 14)
-        ws.set_column(13, 13, 14)
-        ws.set_column(14, 14, 14)
-        ws.set_column(15, 15, 14)
-        ws.set_column(16, 16, 35)
-        ws.set_column(17, 17, 60)
-
-        summary_sheet_name = '統計摘要'
-        workbook = writer.book
-        worksheet = workbook.add_worksheet(summary_sheet_name)
-        writer.sheets[summary_sheet_name] = worksheet
-
-        title_format = workbook.add_format({'bold': True, 'font_size': 14})
-        label_fmt = workbook.add_format({'bold': True, 'align': 'left', 'valign': 'vcenter', 'border': 1, 'bg_color': '#DCE6F1'})
-        value_fmt = workbook.add_format({'bold': True, 'align': 'center', 'valign': 'vcenter', 'border': 1, 'bg_color': '#E2EFDA'})
-        table_title_fmt = workbook.add_format({'bold': True, 'border': 1, 'bg_color': '#F2F2F2'})
-
-        worksheet.write(0, 0, '調貨建議統計摘要', title_format)
-
-        k_labels = ['總調貨建議行數', '總調貨件數', '涉及產品數量', '涉及OM數量']
-        k_values = [kpis.get('總調貨建議行數', 0), kpis.get('總調貨件數', 0), kpis.get('涉及產品數量', 0), kpis.get('涉及OM數量', 0)]
-        for i, (lbl, val) in enumerate(zip(k_labels, k_values)):
-            worksheet.write(2 + i, 0, lbl, label_fmt)
-            worksheet.write(2 + i, 1, val, value_fmt)
-
-        worksheet.set_column(0, 0, 20)
-        worksheet.set_column(1, 1, 12)
-        worksheet.set_column(5, 9, 18)
-
-        sa_start_row, sa_start_col = 8, 0
-        worksheet.write(sa_start_row, sa_start_col, '按Article統計', table_title_fmt)
-        stats_article.to_excel(writer, sheet_name=summary_sheet_name, startrow=sa_start_row + 2, startcol=sa_start_col, index=False)
-
-        so_start_row, so_start_col = 8, 5
-        worksheet.write(so_start_row, so_start_col, '按OM統計', table_title_fmt)
-        stats_om.to_excel(writer, sheet_name=summary_sheet_name, startrow=so_start_row + 2, startcol=so_start_col, index=False)
-
-        transfer_dist = transfer_dist.rename(columns={'涉及行數': '建議數量'})
-        receive_dist = receive_dist.rename(columns={'涉及行數': '建議數量'})
-
-        td_start_row, td_start_col = 20, 0
-        worksheet.write(td_start_row, td_start_col, '轉出類型分析', table_title_fmt)
-        transfer_dist.to_excel(writer, sheet_name=summary_sheet_name, startrow=td_start_row + 2, startcol=td_start_col, index=False)
-
-        rd_start_row, rd_start_col = 20, 5
-        worksheet.write(rd_start_row, rd_start_col, '接收類型分析', table_title_fmt)
-        receive_dist.to_excel(writer, sheet_name=summary_sheet_name, startrow=rd_start_row + 2, startcol=rd_start_col, index=False)
+    # constant_memory 模式逐行寫出並釋放記憶體，因此所有儲存格都必須由上而下按行寫入
+    # 文字欄一律按原樣寫入，不做 URL/公式偵測
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'strings_to_urls': False, 'strings_to_formulas': False})
+    header_fmt = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+
+    column_order = [
+        'Article', 'Product Desc', 'Transfer OM', 'Transfer Site', 'Receive OM', 'Receive Site',
+        'Transfer Qty', 'Original Stock', 'Receive Original Stock', 'After Transfer Stock', 'Safety Stock', 'MOQ',
+        'Source Last Month Sold Qty', 'Source MTD Sold Qty',
+        'Receive Last Month Sold Qty', 'Receive MTD Sold Qty',
+        'Remark', 'Notes'
+    ]
+
+    export_rec_df = rec_df.copy()
+    for col in column_order:
+        if col not in export_rec_df.columns:
+            export_rec_df[col] = ''
+
+    export_rec_df = export_rec_df[column_order]
+    ws = workbook.add_worksheet('調貨建議')
+    for col_idx, width in enumerate(REC_COLUMN_WIDTHS):
+        ws.set_column(col_idx, col_idx, width)
+    ws.write_row(0, 0, column_order, header_fmt)
+    for r, row in enumerate(export_rec_df.itertuples(index=False, name=None), start=1):
+        ws.write_row(r, 0, [_excel_value(v) for v in row])
+
+    summary_sheet_name = '統計摘要'
+    worksheet = workbook.add_worksheet(summary_sheet_name)
+
+    title_format = workbook.add_format({'bold': True, 'font_size': 14})
+    label_fmt = workbook.add_format({'bold': True, 'align': 'left', 'valign': 'vcenter', 'border': 1, 'bg_color': '#DCE6F1'})
+    value_fmt = workbook.add_format({'bold': True, 'align': 'center', 'valign': 'vcenter', 'border': 1, 'bg_color': '#E2EFDA'})
+    table_title_fmt = workbook.add_format({'bold': True, 'border': 1, 'bg_color': '#F2F2F2'})
+
+    # 摘要頁各區塊先收集到 {(row, col): (值, 格式)}，後寫入者覆蓋先寫入者，最後按行輸出
+    cells = {}
+
+    def put_frame(frame, start_row, start_col):
+        for c, name in enumerate(frame.columns):
+            cells[(start_row, start_col + c)] = (name, header_fmt)
+        for r, row in enumerate(frame.itertuples(index=False, name=None), start=start_row + 1):
+            for c, v in enumerate(row):
+                cells[(r, start_col + c)] = (_excel_value(v), None)
+
+    cells[(0, 0)] = ('調貨建議統計摘要', title_format)
+
+    k_labels = ['總調貨建議行數', '總調貨件數', '涉及產品數量', '涉及OM數量']
+    k_values = [kpis.get('總調貨建議行數', 0), kpis.get('總調貨件數', 0), kpis.get('涉及產品數量', 0), kpis.get('涉及OM數量', 0)]
+    for i, (lbl, val) in enumerate(zip(k_labels, k_values)):
+        cells[(2 + i, 0)] = (lbl, label_fmt)
+        cells[(2 + i, 1)] = (val, value_fmt)
+
+    worksheet.set_column(0, 0, 20)
+    worksheet.set_column(1, 1, 12)
+    worksheet.set_column(5, 9, 18)
+
+    sa_start_row, sa_start_col = 8, 0
+    cells[(sa_start_row, sa_start_col)] = ('按Article統計', table_title_fmt)
+    put_frame(stats_article, sa_start_row + 2, sa_start_col)
+
+    so_start_row, so_start_col = 8, 5
+    cells[(so_start_row, so_start_col)] = ('按OM統計', table_title_fmt)
+    put_frame(stats_om, so_start_row + 2, so_start_col)
+
+    transfer_dist = transfer_dist.rename(columns={'涉及行數': '建議數量'})
+    receive_dist = receive_dist.rename(columns={'涉及行數': '建議數量'})
+
+    td_start_row, td_start_col = 20, 0
+    cells[(td_start_row, td_start_col)] = ('轉出類型分析', table_title_fmt)
+    put_frame(transfer_dist, td_start_row + 2, td_start_col)
+
+    rd_start_row, rd_start_col = 20, 5
+    cells[(rd_start_row, rd_start_col)] = ('接收類型分析', table_title_fmt)
+    put_frame(receive_dist, rd_start_row + 2, rd_start_col)
+
+    for (r, c), (val, fmt) in sorted(cells.items()):
+        worksheet.write(r, c, val, fmt)
 
+    workbook.close()
     return output.getvalue()
@@ -2,6 +2,7 @@ try:
     import streamlit as st
     import pandas as pd
     from datetime import datetime
+    from io import BytesIO
     import os
     from transfer_system import TransferOptimizer
 except ImportError as e:
@@ -44,6 +45,27 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_data(show_spinner=False)
+def load_uploaded_excel(file_bytes):
+    """Parse the uploaded workbook once; reruns with the same bytes reuse the cached DataFrame"""
+    # Article is read as text so codes in a column with blanks are not turned into floats ("...012.0").
+    # All columns are kept (no usecols): the preview shows the full sheet and its column count.
+    # pandas already opens openpyxl workbooks read-only; python-calamine is not a dependency.
+    return pd.read_excel(BytesIO(file_bytes), engine='openpyxl', dtype={'Article': str})
+
+@st.cache_data(show_spinner=False)
+def process_uploaded_excel(file_bytes):
+    """Run the transfer pipeline on an upload; re-processing identical bytes returns the cached results"""
+    optimizer = TransferOptimizer()
+    output_file, suggestions = optimizer.process_dataframe(load_uploaded_excel(file_bytes))
+    
+    excel_data = None
+    if os.path.exists(output_file):
+        with open(output_file, "rb") as f:
+            excel_data = f.read()
+    
+    return output_file, suggestions, excel_data
+
 def main():
     st.markdown('<h1 class="main-header">📦 Smart Transfer Optimization System</h1>', unsafe_allow_html=True)
     
@@ -65,97 +87,86 @@ def main():
     
     # Main content area
     if uploaded_file is not None:
+        file_bytes = uploaded_file.getvalue()
+
         if process_btn:
             with st.spinner("Processing file, please wait..."):
                 try:
-                    # Save uploaded file
-                    file_path = f"temp_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-                    with open(file_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                    
-                    # Initialize transfer optimizer
-                    optimizer = TransferOptimizer()
-                    
-                    # Process file
-                    output_file, suggestions = optimizer.process_file(file_path)
-                    
-                    # Display processing results
-                    st.success("✅ File processing completed!")
-                    
-                    # Display transfer recommendations
-                    if suggestions:
-                        st.subheader("📋 Transfer Recommendations Details")
-                        suggestions_df = pd.DataFrame(suggestions)
-                        st.dataframe(suggestions_df)
-                        
-                        # Display statistical information
-                        st.subheader("📊 Statistical Summary")
-                        
-                        col1, col2, col3, col4 = st.columns(4)
-                        
-                        with col1:
-                            st.metric("Total Recommendations", len(suggestions))
-                        
-                        with col2:
-                            total_qty = sum(t['Transfer Qty'] for t in suggestions)
-                            st.metric("Total Transfer Qty", f"{total_qty:,.0f}")
-                        
-                        with col3:
-                            nd_count = len([t for t in suggestions if t['Transfer Type'] == 'ND'])
-                            st.metric("ND Type Transfers", nd_count)
-                        
-                        with col4:
-                            emergency_count = len([t for t in suggestions if t['Receive Priority'] == 'Emergency'])
-                            st.metric("Emergency Transfers", emergency_count)
-                        
-                        # Download buttons
-                        st.subheader("💾 Export Results")
-                        
-                        col_dl1, col_dl2 = st.columns(2)
-                        
-                        with col_dl1:
-                            # CSV Download
-                            csv_data = suggestions_df.to_csv(index=False).encode('utf-8')
-                            st.download_button(
-                                label="📥 Download CSV",
-                                data=csv_data,
-                                file_name=f"transfer_suggestions_{datetime.now().strftime('%Y%m%d')}.csv",
-                                mime="text/csv"
-                                
-                            )
-                        
-                        with col_dl2:
-                            # Excel Download
-                            if os.path.exists(output_file):
-                                with open(output_file, "rb") as f:
-                                    excel_data = f.read()
-                                st.download_button(
-                                    label="📥 Download Excel",
-                                    data=excel_data,
-                                    file_name=output_file,
-                                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                                    
-                                )
-                    
-                    else:
-                        st.info("ℹ️ No transfer suggestions needed for current data")
-                    
-                    # Clean up temporary files
-                    try:
-                        os.remove(file_path)
-                    except:
-                        pass
-                        
+                    # Keep the results in session state so later reruns (e.g. download clicks)
+                    # redisplay them instead of running the pipeline again
+                    st.session_state.transfer_result = (uploaded_file.file_id, *process_uploaded_excel(file_bytes))
                 except Exception as e:
+                    st.session_state.pop('transfer_result', None)
                     st.error(f"❌ Error processing file: {str(e)}")
-        
-        else:
+
+        result = st.session_state.get('transfer_result')
+        if result is not None and result[0] == uploaded_file.file_id:
+            _, output_file, suggestions, excel_data = result
+
+            # Display processing results
+            st.success("✅ File processing completed!")
+
+            # Display transfer recommendations
+            if suggestions:
+                st.subheader("📋 Transfer Recommendations Details")
+                suggestions_df = pd.DataFrame(suggestions)
+                st.dataframe(suggestions_df)
+
+                # Display statistical information
+                st.subheader("📊 Statistical Summary")
+
+                col1, col2, col3, col4 = st.columns(4)
+
+                with col1:
+                    st.metric("Total Recommendations", len(suggestions))
+
+                with col2:
+                    total_qty = sum(t['Transfer Qty'] for t in suggestions)
+                    st.metric("Total Transfer Qty", f"{total_qty:,.0f}")
+
+                with col3:
+                    nd_count = len([t for t in suggestions if t['Transfer Type'] == 'ND'])
+                    st.metric("ND Type Transfers", nd_count)
+
+                with col4:
+                    emergency_count = len([t for t in suggestions if t['Receive Priority'] == 'Emergency'])
+                    st.metric("Emergency Transfers", emergency_count)
+
+                # Download buttons
+                st.subheader("💾 Export Results")
+
+                col_dl1, col_dl2 = st.columns(2)
+
+                with col_dl1:
+                    # CSV Download
+                    csv_data = suggestions_df.to_csv(index=False).encode('utf-8')
+                    st.download_button(
+                        label="📥 Download CSV",
+                        data=csv_data,
+                        file_name=f"transfer_suggestions_{datetime.now().strftime('%Y%m%d')}.csv",
+                        mime="text/csv"
+                    )
+
+                with col_dl2:
+                    # Excel Download
+                    if excel_data is not None:
+                        st.download_button(
+                            label="📥 Download Excel",
+                            data=excel_data,
+                            file_name=output_file,
+                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                        )
+
+            else:
+                st.info("ℹ️ No transfer suggestions needed for current data")
+
+        elif not process_btn:
             # Display file preview
             st.info("📄 File uploaded. Click 'Start Processing' to run transfer analysis")
             
             try:
-                # Read file preview
-                df = pd.read_excel(uploaded_file)
+                # Read file preview (parsed once and cached on the upload's bytes)
+                df = load_uploaded_excel(file_bytes)
                 
                 st.subheader("File Preview")
                 st.dataframe(df.head(10))